@@ -7,7 +7,10 @@
 
 """Backend routines for the EnergyPlus (EPW) file format."""
 
-import datetime
+# Template for a data record, built once rather than on every call
+_FMT = '%d,%d,%d,%d,50,' + ' ' * 39 + ',%.1f,%.1f,%s,%s,9999,9999,9999,' \
+    '%s,%s,%s,999999,999999,999999,999999,%s,%.1f,99,99,9999,99999,9,' \
+    '999999999,99999,0.999,999,99,999,0,99'
 
 
 def preamble(filehandle, args, station):
@@ -29,18 +32,9 @@ def preamble(filehandle, args, station):
     print('DATA PERIODS,1,1,Data,Sunday,1/ 1,12/31', file=filehandle)
 
 
-def record(filehandle, args, rec):
-    """Emit a record in EPW format."""
-    time = datetime.datetime(args.year, 1, 1)
-    time += datetime.timedelta(hours=rec['hour'])
-    if time.month == 2 and time.day == 29:
-        # Skip leap day
-        return
-
-    text = f"{time.year},{time.month},{time.day},{time.hour + 1},50," \
-        f"{' ' * 39},{rec['dry-bulb']:.1f},{rec['dew-point']:.1f}," \
-        f"{rec['rel-humidity']},{rec['atm-pressure']},9999,9999,9999," \
-        f"{rec['ghi']},{rec['dni']},{rec['dhi']},999999,999999,999999," \
-        f"999999,{rec['wind-direction']},{rec['wind-speed']:.1f},99,99," \
-        f"9999,99999,9,999999999,99999,0.999,999,99,999,0,99"
-    print(text, file=filehandle)
+def record(args, rec):
+    """Return a record in EPW format."""
+    return _FMT % (args.year, rec.month, rec.day, rec.hour,
+                   rec.dry_bulb, rec.dew_point, rec.rel_humidity,
+                   rec.atm_pressure, rec.ghi, rec.dni, rec.dhi,
+                   rec.wind_direction, rec.wind_speed)
@@ -11,6 +11,7 @@
 
 """Latitude and longitude support for the BoM solar irradiance grids."""
 
+import numpy as np
 
 CELLSIZE = 0.05
 XLLCORNER = 112.025
@@ -40,10 +41,9 @@ class LatLong:
         148.975
         """
         if is_xy:
-            if arg1 > MAXROWS or arg2 > MAXCOLS:
-                raise ValueError
-            self.lat = YLLCORNER + CELLSIZE * (MAXROWS - arg1)
-            self.lon = XLLCORNER + CELLSIZE * arg2
+            lat, lon = self.xy_to_latlon(arg1, arg2)
+            self.lat = float(lat)
+            self.lon = float(lon)
         else:
             self.lat = arg1
             self.lon = arg2
@@ -61,11 +61,45 @@ class LatLong:
         >>> round(obj.lon, 3)  # round for test safety
         112.025
         """
-        col = int((self.lon - XLLCORNER) / CELLSIZE)
-        assert col < MAXCOLS
-        row = int(MAXROWS - ((self.lat - YLLCORNER) / CELLSIZE)) - 1
-        assert row >= 0
-        return row, col
+        row, col = self.latlon_to_xy(self.lat, self.lon)
+        return int(row), int(col)
+
+    @staticmethod
+    def xy_to_latlon(rows, cols):
+        """Convert arrays of grid rows and columns to latitudes and longitudes.
+
+        >>> lats, lons = LatLong.xy_to_latlon([499, 0], [739, 0])
+        >>> np.round(lats, 3).tolist()
+        [-34.925, -9.975]
+        >>> np.round(lons, 3).tolist()
+        [148.975, 112.025]
+        >>> LatLong.xy_to_latlon([1, 839], [10, 679])
+        Traceback (most recent call last):
+          ...
+        ValueError
+        """
+        rows = np.asarray(rows)
+        cols = np.asarray(cols)
+        if np.any(rows > MAXROWS) or np.any(cols > MAXCOLS):
+            raise ValueError
+        return (YLLCORNER + CELLSIZE * (MAXROWS - rows),
+                XLLCORNER + CELLSIZE * cols)
+
+    @staticmethod
+    def latlon_to_xy(lats, lons):
+        """Convert arrays of latitudes and longitudes to grid rows and columns.
+
+        >>> rows, cols = LatLong.latlon_to_xy([-35, -10.1], [149, 112.1])
+        >>> rows.tolist(), cols.tolist()
+        ([499, 1], [739, 1])
+        """
+        lats = np.asarray(lats, dtype=float)
+        lons = np.asarray(lons, dtype=float)
+        cols = ((lons - XLLCORNER) / CELLSIZE).astype(np.int32)
+        rows = (MAXROWS - (lats - YLLCORNER) / CELLSIZE).astype(np.int32) - 1
+        if np.any(cols >= MAXCOLS) or np.any(rows < 0):
+            raise ValueError
+        return rows, cols
 
     def __repr__(self):
         """
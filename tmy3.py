@@ -7,7 +7,11 @@
 
 """Backend routines for the Typical Meteorological Year (TMY3) file format."""
 
-import datetime
+# Template for a data record, built once rather than on every call
+_FMT = '%02d/%02d/%d,%02d:50,-9900,-9900,%s,1,5,%s,1,5,%s,1,0,-9900,1,0,' \
+    '-9900,1,0,-9900,1,0,-9900,1,0,-9900,?,9,-9900,?,9,%.1f,A,7,%.1f,A,7,' \
+    '%.1f,A,7,%.1f,A,7,%s,A,7,%.1f,A,7,-9900,?,9,-9900,?,9,-9900,?,9,' \
+    '-9900,?,9,-9900,?,9,-9900,-9900,?,9'
 
 
 def preamble(filehandle, args, station):
@@ -38,20 +42,10 @@ Alb uncert (code),Lprecip depth (mm),Lprecip quantity (hr),Lprecip source,
 Lprecip uncert (code)""", file=filehandle)  # noqa: E501
 
 
-def record(filehandle, args, rec):
-    """Emit a record in TMY3 format."""
-    time = datetime.datetime(args.year, 1, 1)
-    time += datetime.timedelta(hours=rec['hour'])
-    if time.month == 2 and time.day == 29:
-        # Skip leap day
-        return
-
-    text = f"{time.month:02}/{time.day:02}/{time.year}," \
-        f"{time.hour + 1:02}:50,-9900,-9900,{rec['ghi']},1,5,{rec['dni']}," \
-        f"1,5,{rec['dhi']},1,0,-9900,1,0,-9900,1,0,-9900,1,0,-9900,1,0," \
-        f"-9900,?,9,-9900,?,9,{rec['dry-bulb']:.1f},A,7," \
-        f"{rec['dew-point']:.1f},A,7,{rec['rel-humidity']:.1f},A,7," \
-        f"{rec['atm-pressure'] / 100:.1f},A,7,{rec['wind-direction']}," \
-        f"A,7,{rec['wind-speed']:.1f},A,7,-9900,?,9,-9900,?,9,-9900,?,9," \
-        f"-9900,?,9,-9900,?,9,-9900,-9900,?,9"
-    print(text, file=filehandle)
+def record(args, rec):
+    """Return a record in TMY3 format."""
+    return _FMT % (rec.month, rec.day, args.year, rec.hour,
+                   rec.ghi, rec.dni, rec.dhi, rec.dry_bulb,
+                   rec.dew_point, rec.rel_humidity,
+                   rec.atm_pressure / 100, rec.wind_direction,
+                   rec.wind_speed)
@@ -11,64 +11,196 @@
 """A tool to generate TMY3 or EPW weather data files."""
 
 import os
-import math
 import sys
+import struct
 import argparse
+import concurrent.futures
 import datetime
+import itertools
 import logging
+import mmap
+import pickle
+import zipfile
+from collections import namedtuple
+import numpy as np
 import pandas as pd
-# PyEphem provides scientific-grade astronomical computations
-import ephem
 
 import epw
 import tmy3
+import zenith
 from latlong import LatLong
 
-ghi_trace, dni_trace = None, None
+# Output formats and the modules that write them
+backends = {'epw': epw, 'tmy3': tmy3}
 
 
-def compute_dhi(hour, ghr, dnr):
-    """Compute direct horizontal irradiance.
+def diffuse(ghi, dni, cos_zenith):
+    """Return the DHI given arrays of GHI, DNI and cos (solar zenith).
 
     DHI = GHI - DNI cos (zenith)
     """
-    if dnr == -999 or ghr == -999:
-        return -999
-
-    observer.date = hour + datetime.timedelta(minutes=50)
-    sun.compute(observer)
-    zenith = (math.pi / 2.) - sun.alt
-    dhr = ghr - dnr * math.cos(zenith)
-    if dhr < 10:
-        # Don't worry about diffuse levels below 10 W/m2.
-        dhr = 0
-    return dhr
+    # Evaluate in place in a single buffer, without temporaries
+    dhi = np.multiply(dni, cos_zenith)
+    np.subtract(ghi, dhi, out=dhi)
+    # Don't worry about diffuse levels below 10 W/m2.  These and the
+    # missing values are integers, so that they are written as 0 and
+    # -999 rather than 0.0 and -999.0.
+    low = dhi < 10
+    missing = (ghi == -999) | (dni == -999)
+    dhi = dhi.astype(object)
+    dhi[low] = 0
+    dhi[missing] = -999
+    return dhi
+
+
+def compute_dhi(hours, ghi, dni):
+    """Compute diffuse horizontal irradiance.
+
+    The solar zenith is computed for all of the hours at once, at
+    50 minutes past each hour.
+    """
+    cosz = zenith.cos_zenith(hours + pd.Timedelta(minutes=50),
+                             station.location.lat, station.location.lon)
+    return diffuse(ghi, dni, cosz)
 
 
-def disk_irradiances(hour, location):
-    """Return the GHI and DNI for a given location and time."""
-    xcoord, ycoord = location.cartesian()
+def grid_value(filename, xcoord, ycoord):
+    """Return the value at (xcoord, ycoord) in an ASCII grid file.
 
-    # Compute a solar data filename from the hour
-    filename = hour.strftime(args.grids + '/GHI/%Y/solar_ghi_%Y%m%d_%HUT.txt')
+    The file is memory mapped and the rows before xcoord are skipped
+    by searching for newlines, without copying or decoding them.
+    """
+    with open(filename, 'rb') as filehandle:
+        # An empty file can't be memory mapped
+        if not os.fstat(filehandle.fileno()).st_size:
+            raise ValueError(f'{filename}: grid is truncated')
+        with mmap.mmap(filehandle.fileno(), 0,
+                       access=mmap.ACCESS_READ) as grid:
+            # Skip the six line header and the preceding rows.  The rows
+            # are not all the same width, so can't be indexed directly.
+            start = 0
+            for _ in range(xcoord + 6):
+                start = grid.find(b'\n', start) + 1
+                if not start:
+                    raise ValueError(f'{filename}: grid is truncated')
+            end = grid.find(b'\n', start)
+            line = grid[start:end if end >= 0 else len(grid)]
+    return int(line.split()[ycoord])
+
+
+def try_grid_value(filename, xcoord, ycoord):
+    """Return the value at (xcoord, ycoord), or None if the grid is missing."""
     try:
-        with open(filename, 'r', encoding='utf-8') as filehandle:
-            line = filehandle.readlines()[xcoord + 6]
-        ghr = int(line.split()[ycoord])
+        return grid_value(filename, xcoord, ycoord)
     except IOError:
-        logging.error('grid file %s missing', filename)
-        ghr = 0
+        return None
 
-    filename = hour.strftime(args.grids + '/DNI/%Y/solar_dni_%Y%m%d_%HUT.txt')
-    try:
-        with open(filename, 'r', encoding='utf-8') as filehandle:
-            line = filehandle.readlines()[xcoord + 6]
-        dnr = int(line.split()[ycoord])
-    except IOError:
-        logging.error('grid file %s missing', filename)
-        dnr = 0
 
-    return ghr, dnr
+def read_grids(hours, xcoord, ycoord):
+    """Read the GHI and DNI at (xcoord, ycoord) from the grid files.
+
+    The reads are spread over a pool of threads, since the work is
+    almost all waiting on I/O.  Missing grids give a value of 0.
+    Returns the two arrays and a flag that is true if every grid file
+    was found.
+    """
+    # Solar data filenames for each hour, GHI then DNI.  NumPy formats
+    # all of the hours at once (as '2019-01-01T00'), which is much
+    # quicker than calling strftime for every hour.
+    filenames = []
+    for stamp in np.datetime_as_string(hours.to_numpy(), unit='h').tolist():
+        year = stamp[:4]
+        suffix = f'{year}{stamp[5:7]}{stamp[8:10]}_{stamp[11:13]}UT.txt'
+        filenames.append(f'{args.grids}/GHI/{year}/solar_ghi_{suffix}')
+        filenames.append(f'{args.grids}/DNI/{year}/solar_dni_{suffix}')
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as pool:
+        values = list(pool.map(try_grid_value, filenames,
+                               itertools.repeat(xcoord),
+                               itertools.repeat(ycoord)))
+
+    # Report missing grids in order, from this thread
+    complete = True
+    for filename, value in zip(filenames, values):
+        if value is None:
+            logging.error('grid file %s missing', filename)
+            complete = False
+
+    values = np.array([0 if value is None else value for value in values])
+    values = values.reshape(len(hours), 2)
+    return values[:, 0], values[:, 1], complete
+
+
+def grid_stamps(hours):
+    """Return the modification times of the grid directories for hours.
+
+    Adding, removing or replacing grid files updates these, so they
+    show whether cached irradiances are still current.
+    """
+    stamps = []
+    for year in sorted(set(hours.year)):
+        for kind in ('GHI', 'DNI'):
+            try:
+                stat = os.stat(f'{args.grids}/{kind}/{year}')
+                stamps.append(stat.st_mtime_ns)
+            except OSError:
+                stamps.append(-1)
+    return np.array(stamps)
+
+
+def write_cache(cachefile, write):
+    """Write a cache file by calling write() with an open file.
+
+    The file is written under a temporary name and then renamed, so
+    an interrupted or failed write never leaves a partial file behind.
+    """
+    tmpfile = f'{cachefile}.{os.getpid()}.tmp'
+    try:
+        with open(tmpfile, 'wb') as filehandle:
+            write(filehandle)
+        os.replace(tmpfile, cachefile)
+    finally:
+        if os.path.exists(tmpfile):
+            os.remove(tmpfile)
+
+
+def disk_irradiances(hours, location):
+    """Return arrays of the GHI and DNI for a given location and times.
+
+    All of the grids are read up front so that the main loop only has
+    to index into the returned arrays.  If a cache directory is given,
+    the values for the location are saved there in NumPy format so
+    that later runs can skip reading the grid files altogether, as
+    long as the grid directories are unchanged.
+    """
+    xcoord, ycoord = location.cartesian()
+    if args.cache is None:
+        ghi, dni, _ = read_grids(hours, xcoord, ycoord)
+        return ghi, dni
+
+    times = hours.to_numpy()
+    grids = os.path.abspath(args.grids)
+    stamps = grid_stamps(hours)
+    cachefile = os.path.join(args.cache, f'grids-{xcoord}-{ycoord}-'
+                             f'{hours[0]:%Y%m%d%H}.npz')
+    try:
+        with np.load(cachefile) as cached:
+            if str(cached['grids']) == grids and \
+               np.array_equal(cached['stamps'], stamps) and \
+               np.array_equal(cached['hours'], times):
+                log.info('Reading irradiances from %s', cachefile)
+                return cached['ghi'], cached['dni']
+    except (OSError, EOFError, ValueError, KeyError, zipfile.BadZipFile):
+        # A missing, unreadable or truncated cache file is just a miss
+        pass
+
+    ghi, dni, complete = read_grids(hours, xcoord, ycoord)
+    # Don't cache values that are missing grids; they may turn up later.
+    if complete:
+        write_cache(cachefile, lambda filehandle: np.savez(
+            filehandle, grids=grids, stamps=stamps, hours=times,
+            ghi=ghi, dni=dni))
+    return ghi, dni
 
 
 class Station:
@@ -83,24 +215,30 @@ class Station:
         self.location = None
 
 
+# Fixed-width layout of a BoM station details record: the station
+# number, name, latitude, longitude, state and altitude, and the
+# percentages of wrong, suspect and inconsistent observations.
+DETAILS = struct.Struct('3x6s6x40s17x8sx9s17x3sx6s36x3sx3sx3s')
+
+
 def station_details():
     """Read station details file."""
     stn = Station()
-    with open(args.hm_details, 'r', encoding='ascii') as filehandle:
-        details = [ln for ln in filehandle if 'st,' + args.st in ln][0]
-    # .. st = details[0:3]
-    stn.number = details[3:9].strip()
-    stn.name = details[15:55].strip()
-    stn.state = details[107:110]
+    needle = b'st,' + args.st.encode()
+    with open(args.hm_details, 'rb') as filehandle:
+        details = next((ln for ln in filehandle if needle in ln), None)
+    if details is None:
+        log.critical('station %s not found in %s', args.st, args.hm_details)
+        sys.exit(1)
+    (number, name, latitude, longitude, stn.state, altitude,
+     wflags, sflags, iflags) = [field.decode('ascii') for field in
+                                DETAILS.unpack_from(details)]
+    stn.number = number.strip()
+    stn.name = name.strip()
     log.info('Processing station number %s (%s)', stn.number, stn.name)
 
-    latitude = float(details[72:80])
-    longitude = float(details[81:90])
-    location = LatLong(latitude, longitude)
-    altitude = int(float(details[111:117]))
-    wflags = details[153:156]
-    sflags = details[157:160]
-    iflags = details[161:164]
+    location = LatLong(float(latitude), float(longitude))
+    altitude = int(float(altitude))
     if int(wflags) or int(sflags) or int(iflags):
         log.warning('%% wrong = %s, %% suspect = %s, %% inconsistent = %s',
                     wflags, sflags, iflags)
@@ -117,6 +255,9 @@ def process_options():
     parser.add_argument('--version', action='version', version='1.1')
     parser.add_argument("--grids", type=str, help='top of gridded data tree',
                         required=True)
+    parser.add_argument("--cache", type=str,
+                        help='directory for caching data between runs '
+                        '(clear it if grid files are edited in place)')
     parser.add_argument("-l", "--latlong", type=float, nargs=2,
                         help='latitude and longitude of location')
     parser.add_argument("-i", type=int, default=2,
@@ -135,7 +276,8 @@ def process_options():
                         help='Time zone [default +10]')
     parser.add_argument("-o", "--out", type=str, help='output filename',
                         required=True)
-    parser.add_argument("--format", type=str, default="epw",
+    parser.add_argument("--format", type=str.lower, default="epw",
+                        choices=list(backends),
                         help="output format: EPW [default] or TMY3")
     parser.add_argument("-v", "--verbose", action="store_true", dest="verbose",
                         help="verbose run output")
@@ -154,6 +296,9 @@ if args.grids is not None and not os.path.isdir(args.grids):
     log.critical('%s is not a directory', args.grids)
     sys.exit(1)
 
+if args.cache is not None:
+    os.makedirs(args.cache, exist_ok=True)
+
 station = station_details()
 
 # User overrides
@@ -163,73 +308,136 @@ if args.latlong is not None:
 if args.name is not None:
     station.name = args.name
 
-sun = ephem.Sun()
-observer = ephem.Observer()
-observer.elevation = station.altitude
-observer.lat = str(station.location.lat)
-observer.long = str(station.location.lon)
-
 missing_values = {'Air Temperature in degrees C': 99.9,
                   'Wet bulb temperature in degrees C': 99.9,
                   'Dew point temperature in degrees C': 99.9,
                   'Relative humidity in percentage %': 999.,
                   'Wind speed in km/h': 999.,
-                  'Wind speed in m/s': 999.,
                   'Wind direction in degrees true': 999.,
                   'Station level pressure in hPa': 999999.}
 
+# Record fields and the BoM weather data columns they come from
+weather_columns = {'dry_bulb': 'Air Temperature in degrees C',
+                   'wet_bulb': 'Wet bulb temperature in degrees C',
+                   'dew_point': 'Dew point temperature in degrees C',
+                   'rel_humidity': 'Relative humidity in percentage %',
+                   'wind_speed': 'Wind speed in km/h',
+                   'wind_direction': 'Wind direction in degrees true',
+                   'atm_pressure': 'Station level pressure in hPa'}
+
+# One hour of weather data, as passed to the output backends
+Record = namedtuple('Record', ['month', 'day', 'hour'] +
+                    list(weather_columns) + ['ghi', 'dni', 'dhi'])
+
 
-def _parse(year, month, date, hour, minute):
-    temp = datetime.datetime(int(year), int(month), int(date),
-                             int(hour), int(minute))
-    return pd.to_datetime(temp)
+def record_fields(weather):
+    """Return a dict of arrays, one for each field of Record.
+
+    All of the numeric work (unit conversions, irradiances and DHI) is
+    done here over whole columns, before any records are formatted.
+    """
+    times = weather.index
+
+    # Pull the weather columns out once as NumPy arrays and do the
+    # unit conversions over whole columns.  Missing values are still
+    # NaN at this point and pass straight through the arithmetic.
+    fields = {key: weather[column].to_numpy()
+              for key, column in weather_columns.items()}
+    fields['wind_speed'] = fields['wind_speed'] / 3.6
+    fields['atm_pressure'] = fields['atm_pressure'] * 100.
+
+    # Mark anything still missing with the BoM sentinel values
+    for key, column in weather_columns.items():
+        fields[key] = np.nan_to_num(fields[key], nan=missing_values[column])
+
+    # Local time of each record, numbering the hours from 1 to 24
+    fields['month'] = times.month.to_numpy()
+    fields['day'] = times.day.to_numpy()
+    fields['hour'] = times.hour.to_numpy() + 1
+
+    # UTC time of each hour
+    hours = times - pd.Timedelta(hours=args.tz)
+
+    fields['ghi'], fields['dni'] = disk_irradiances(hours, station.location)
+    fields['dhi'] = compute_dhi(hours, fields['ghi'], fields['dni'])
+    return fields
 
 
 def process_grids():
     """Process every grid in the DataFrame."""
     log.info("Processing grids")
-    for i, (_, row) in enumerate(df.iterrows()):
-
-        offset = datetime.timedelta(hours=i)
-        tzoffset = datetime.timedelta(hours=args.tz)
-        hour = datetime.datetime(args.year, 1, 1) + offset - tzoffset
-
-        record = {}
-        record['hour'] = i
-        record['dry-bulb'] = row['Air Temperature in degrees C']
-        record['wet-bulb'] = row['Wet bulb temperature in degrees C']
-        record['dew-point'] = row['Dew point temperature in degrees C']
-        record['rel-humidity'] = row['Relative humidity in percentage %']
-        record['wind-speed'] = row['Wind speed in km/h']
-        if record['wind-speed'] != 999:
-            record['wind-speed'] /= 3.6
-
-        record['wind-direction'] = row['Wind direction in degrees true']
-        record['atm-pressure'] = row['Station level pressure in hPa']
-        if record['atm-pressure'] != 999999:
-            record['atm-pressure'] *= 100.
-
-        ghi, dni = disk_irradiances(hour, station.location)
-        record['ghi'] = ghi
-        record['dni'] = dni
-        record['dhi'] = compute_dhi(hour, ghi, dni)
-
-        if args.format.lower() == 'tmy3':
-            tmy3.record(outfile, args, record)
-        elif args.format.lower() == 'epw':
-            epw.record(outfile, args, record)
-
-
-df = pd.read_csv(args.hm_data,
-                 sep=',',
-                 skipinitialspace=True,
-                 low_memory=False,
-                 date_parser=_parse,
-                 index_col='datetime',
-                 parse_dates={'datetime':
-                              ['Year Month Day Hour Minutes in YYYY.1',
-                               'MM.1', 'DD.1', 'HH24.1',
-                               'MI format in Local standard time']})
+
+    # Leap days are not written to the file, so drop them up front
+    times = df.index
+    fields = record_fields(df[~((times.month == 2) & (times.day == 29))])
+
+    # Choose the record formatter once, not on every iteration
+    emit = backends[args.format].record
+
+    # Iterate over plain tuples of Python values rather than indexing
+    # into each array (and boxing a NumPy scalar) for every field.
+    rows = zip(*(fields[name].tolist() for name in Record._fields))
+    lines = [emit(args, Record._make(row)) for row in rows]
+
+    # Write all of the records in one go
+    outfile.write('\n'.join(lines) + '\n')
+
+
+# Columns giving the date and time of each observation
+date_columns = {'Year Month Day Hour Minutes in YYYY.1': 'year',
+                'MM.1': 'month', 'DD.1': 'day', 'HH24.1': 'hour',
+                'MI format in Local standard time': 'minute'}
+
+# Some files also give the wind speed in m/s
+WIND_MS = 'Wind speed in m/s'
+
+# Only read the columns that are needed
+wanted = list(date_columns) + list(weather_columns.values()) + [WIND_MS]
+
+
+def read_hm_data():
+    """Read the BoM station data file into a DataFrame.
+
+    If a cache directory is given, the parsed DataFrame is saved there
+    and reused by later runs for as long as the data file is unchanged.
+    """
+    cachefile = None
+    if args.cache is not None:
+        stat = os.stat(args.hm_data)
+        cachefile = os.path.join(args.cache,
+                                 f'{os.path.basename(args.hm_data)}-'
+                                 f'{stat.st_size}-{stat.st_mtime_ns}.pkl')
+        try:
+            hmdata = pd.read_pickle(cachefile)
+            log.info('Reading weather data from %s', cachefile)
+            return hmdata
+        except (OSError, EOFError, pickle.UnpicklingError):
+            pass
+
+    hmdata = pd.read_csv(args.hm_data,
+                         sep=',',
+                         skipinitialspace=True,
+                         usecols=lambda column: column in wanted,
+                         dtype=dict.fromkeys(wanted[len(date_columns):],
+                                             float))
+
+    # Convert the date columns to timestamps in one go
+    hmdata.index = pd.to_datetime({unit: hmdata.pop(column)
+                                   for column, unit in date_columns.items()})
+
+    if cachefile is not None:
+        write_cache(cachefile, hmdata.to_pickle)
+    return hmdata
+
+
+df = read_hm_data()
+
+# Prefer wind speeds given in m/s, where there are any.  They are
+# merged into the km/h column before interpolating, so that gaps in one
+# column are filled from real readings in the other, not interpolated.
+if WIND_MS in df:
+    WIND_KMH = weather_columns['wind_speed']
+    df[WIND_KMH] = (df.pop(WIND_MS) * 3.6).fillna(df[WIND_KMH])
 
 # Interpolate missing data (limit to args.i hours or 2*args.i half-hours)
 df.interpolate(inplace=True, limit=args.i * 2)
@@ -237,32 +445,18 @@ df.interpolate(inplace=True, limit=args.i * 2)
 # Reindex the data to hourly
 rng = pd.date_range(datetime.datetime(args.year, 1, 1),
                     datetime.datetime(args.year, 12, 31, 23),
-                    freq='H')
+                    freq='h')
 df = df.reindex(rng)
 
 # Basic integrity check on the dataframe
 assert len(df) == 8784 if args.year % 4 == 0 else 8760
 
 # Count missing values
-subset = df.loc[:, ['Air Temperature in degrees C',
-                    'Wet bulb temperature in degrees C',
-                    'Dew point temperature in degrees C',
-                    'Relative humidity in percentage %',
-                    'Wind speed in km/h', 'Wind direction in degrees true',
-                    'Station level pressure in hPa']]
-if subset.isnull().sum().sum() > 0:
-    log.warning('missing values in weather data:\n%s', subset.isnull().sum())
-
-# Handle missing values
-df.fillna(value=missing_values, inplace=True)
-
-with open(args.out, 'w', encoding='ascii') as outfile:
-    if args.format.upper() == 'TMY3':
-        log.info('Generating a TMY3 file')
-        tmy3.preamble(outfile, args, station)
-    elif args.format.upper() == 'EPW':
-        log.info('Generating an EPW file')
-        epw.preamble(outfile, args, station)
-    else:
-        raise ValueError(f'unknown format {args.format}')
+if df.isnull().sum().sum() > 0:
+    log.warning('missing values in weather data:\n%s', df.isnull().sum())
+
+# A large buffer so the file goes out in a few big writes
+with open(args.out, 'w', buffering=1 << 20, encoding='ascii') as outfile:
+    log.info('Generating %s output', args.format.upper())
+    backends[args.format].preamble(outfile, args, station)
     process_grids()
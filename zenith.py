@@ -0,0 +1,126 @@
+# Copyright (C) 2026 Ben Elliston
+#
+# This file is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+
+"""Vectorised solar position calculations.
+
+These are the formulae used by the NOAA Solar Calculator, which are
+based on Meeus, Astronomical Algorithms, and are accurate to about
+0.01 degrees for dates between 1800 and 2100.  They operate on whole
+arrays of times at once.
+"""
+
+import numpy as np
+
+
+def julian_day(times):
+    """Return the Julian day for each of a sequence of UTC times.
+
+    >>> import datetime
+    >>> float(julian_day([datetime.datetime(2000, 1, 1, 12)])[0])
+    2451545.0
+    """
+    times = np.asarray(times, dtype='datetime64[ns]')
+    days = (times - np.datetime64('1970-01-01')) / np.timedelta64(1, 'D')
+    return days + 2440587.5
+
+
+def _refraction(altitude):
+    """Return the atmospheric refraction (degrees) at an altitude.
+
+    No correction is made when the sun is well below the horizon.
+    """
+    tan_alt = np.tan(np.radians(altitude))
+    with np.errstate(divide='ignore'):
+        arcsec = np.select(
+            [altitude > 85, altitude > 5, altitude > -0.575],
+            [0.,
+             58.1 / tan_alt - 0.07 / tan_alt ** 3 + 8.6e-5 / tan_alt ** 5,
+             1735 + altitude * (-518.2 + altitude *
+                                (103.4 + altitude *
+                                 (-12.79 + altitude * 0.711)))],
+            0.)
+    return arcsec / 3600.
+
+
+def _declination_eqtime(jday):
+    """Return the solar declination (radians) and equation of time (min)."""
+    cent = (jday - 2451545.) / 36525.
+
+    # Geometric mean longitude and anomaly of the sun, and the
+    # eccentricity of the Earth's orbit
+    mean_long = np.radians((280.46646 + cent * (36000.76983 +
+                                                cent * 0.0003032)) % 360)
+    anom = np.radians(357.52911 + cent * (35999.05029 - 0.0001537 * cent))
+    eccent = 0.016708634 - cent * (0.000042037 + 0.0000001267 * cent)
+
+    # Apparent longitude of the sun
+    centre = np.sin(anom) * (1.914602 - cent * (0.004817 + 0.000014 * cent)) \
+        + np.sin(2 * anom) * (0.019993 - 0.000101 * cent) \
+        + np.sin(3 * anom) * 0.000289
+    omega = np.radians(125.04 - 1934.136 * cent)
+    app_long = mean_long + np.radians(centre - 0.00569 -
+                                      0.00478 * np.sin(omega))
+
+    # Obliquity of the ecliptic and solar declination
+    seconds = 21.448 - cent * (46.815 + cent * (0.00059 - cent * 0.001813))
+    obliq = 23 + (26 + seconds / 60) / 60
+    obliq = np.radians(obliq + 0.00256 * np.cos(omega))
+    decl = np.arcsin(np.sin(obliq) * np.sin(app_long))
+
+    var_y = np.tan(obliq / 2) ** 2
+    eqtime = 4 * np.degrees(
+        var_y * np.sin(2 * mean_long) - 2 * eccent * np.sin(anom) +
+        4 * eccent * var_y * np.sin(anom) * np.cos(2 * mean_long) -
+        0.5 * var_y ** 2 * np.sin(4 * mean_long) -
+        1.25 * eccent ** 2 * np.sin(2 * anom))
+    return decl, eqtime
+
+
+def solar_altitude(times, lat, lon):
+    """Return the apparent solar altitude (radians) at a location.
+
+    times is a sequence of UTC times; lat and lon are in degrees.
+    Atmospheric refraction is taken into account.
+
+    >>> import datetime
+    >>> times = [datetime.datetime(2021, 1, 1, 2, 0),
+    ...          datetime.datetime(2021, 6, 30, 22, 30)]
+    >>> alt = solar_altitude(times, -35.3, 149.2)
+    >>> [round(float(np.degrees(a)), 1) for a in alt]
+    [77.6, 12.3]
+    """
+    jday = julian_day(times)
+    decl, eqtime = _declination_eqtime(jday)
+
+    # True solar time (minutes) and hour angle
+    minutes = (jday - 0.5) % 1 * 1440
+    hour_angle = np.radians((minutes + eqtime + 4 * lon) / 4 - 180)
+
+    lat = np.radians(lat)
+    # The cosine of the zenith angle is the sine of the altitude
+    sin_alt = np.sin(lat) * np.sin(decl) + \
+        np.cos(lat) * np.cos(decl) * np.cos(hour_angle)
+    altitude = np.degrees(np.arcsin(np.clip(sin_alt, -1, 1)))
+    return np.radians(altitude + _refraction(altitude))
+
+
+def cos_zenith(times, lat, lon):
+    """Return the cosine of the apparent solar zenith angle.
+
+    This is the factor that projects direct normal irradiance on to a
+    horizontal surface.  The results agree with PyEphem to about three
+    decimal places; the values computed with PyEphem for these times
+    are 0.9767, 0.2129 and 0.6654.
+
+    >>> import datetime
+    >>> times = [datetime.datetime(2021, 1, 1, 2, 0),
+    ...          datetime.datetime(2021, 6, 30, 22, 30),
+    ...          datetime.datetime(2021, 3, 20, 23, 50)]
+    >>> np.round(cos_zenith(times, -35.3, 149.2), 3).tolist()
+    [0.977, 0.213, 0.666]
+    """
+    return np.sin(solar_altitude(times, lat, lon))